@@ -20,6 +20,84 @@ from remip_example.config import (
 from remip_example.utils import get_mcp_toolset
 
 
+def _str_repr_prefix(value: str, size: int) -> str:
+    """Returns the first characters of repr(value), reading at most size of value."""
+    if len(value) <= size:
+        return repr(value)
+    text = repr(value[:size])
+    # repr() picks its quotes from the whole string; match the full value's.
+    quote = '"' if "'" in value and '"' not in value else "'"
+    if text[0] != quote:
+        body = text[1:-1]
+        if quote == "'":
+            body = body.replace("'", "\\'")
+        text = quote + body + quote
+    return text
+
+
+class _LimitReached(Exception):
+    pass
+
+
+def _bounded_repr(value: Any, limit: int) -> str:
+    """Returns repr(value) cut after limit + 1 characters, built no further."""
+    parts: list[str] = []
+    size = 0
+
+    def write(text: str) -> None:
+        nonlocal size
+        parts.append(text)
+        size += len(text)
+        if size > limit:
+            raise _LimitReached
+
+    def render(item: Any) -> None:
+        kind = type(item)
+        if kind is str:
+            write(_str_repr_prefix(item, limit + 1 - size))
+        elif kind is dict:
+            write("{")
+            for i, (key, val) in enumerate(item.items()):
+                if i:
+                    write(", ")
+                render(key)
+                write(": ")
+                render(val)
+            write("}")
+        elif kind is list or kind is tuple:
+            write("[" if kind is list else "(")
+            for i, element in enumerate(item):
+                if i:
+                    write(", ")
+                render(element)
+            if kind is tuple and len(item) == 1:
+                write(",")
+            write("]" if kind is list else ")")
+        else:
+            write(repr(item))
+
+    try:
+        render(value)
+    except _LimitReached:
+        pass
+    return "".join(parts)[: limit + 1]
+
+
+def _truncate(value: Any, limit: int = 128) -> str:
+    """Returns value as a string of at most limit characters plus an ellipsis."""
+    if isinstance(value, bytes):
+        # Decide on the byte length; multibyte text decodes to fewer characters.
+        text = value[:limit].decode(errors="replace")
+        return text + "..." if len(value) > limit else text
+    if type(value) in (dict, list, tuple):
+        # Render containers only up to the limit, instead of building str()
+        # of a multi-megabyte argument just to slice it.
+        text = _bounded_repr(value, limit)
+    else:
+        text = str(value)
+    return text[:limit] + "..." if len(text) > limit else text
+
+
 def clear_tool_calling_track(callback_context: CallbackContext) -> None:
     callback_context.state["tools_used"] = []
 
@@ -33,10 +111,7 @@ def track_tool_calling(
     if "tools_used" not in tool_context.state:
         tool_context.state["tools_used"] = []
 
-    truncated_args: dict[str, str] = {}
-    for k, v in args.items():
-        value = str(v)
-        truncated_args[k] = value[:128] + "..." if len(value) > 128 else value
+    truncated_args = {k: _truncate(v) for k, v in args.items()}
 
     success = True
     if tool_response is None:
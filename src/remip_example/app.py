@@ -1,7 +1,7 @@
 import asyncio
 import json
+import logging
 import os
-from queue import Empty, Queue
 import re
 import threading
 import uuid
@@ -19,9 +19,25 @@ from streamlit.runtime.scriptrunner import add_script_run_ctx
 from streamlit_autorefresh import st_autorefresh
 
 from remip_example.agent import build_agent
-from remip_example.config import APP_NAME, AVATARS, USAGE
+from remip_example.config import (
+    APP_NAME,
+    AVATARS,
+    MAX_BATCHED_MESSAGES,
+    USAGE,
+)
 from remip_example.utils import load_examples
 
+logger = logging.getLogger(__name__)
+
+
+def merge_user_messages(messages: list[Content]) -> Content:
+    if len(messages) == 1:
+        return messages[0]
+    text = "\n\n".join(
+        part.text for message in messages for part in message.parts if part.text
+    )
+    return Content(role="user", parts=[Part(text=text)])
+
 
 class BackgroundAgentRunner:
     def __init__(self, user_id: str, api_key: str):
@@ -29,9 +45,12 @@ class BackgroundAgentRunner:
         self._api_key = api_key
         self._session_service = None
         self._event_history = []
-        self._stop = threading.Event()
-        self._interrupt = threading.Event()
-        self._input_queue = Queue[Content]()
+        self._loop = asyncio.new_event_loop()
+        # Fed from other threads via call_soon_threadsafe.
+        self._input_queue = asyncio.Queue[Content]()
+        self._task: asyncio.Task | None = None
+        self._current_run: asyncio.Future | None = None
+        self._error: Exception | None = None
         self._thread = threading.Thread(
             target=self._run,
             daemon=True,
@@ -39,12 +58,42 @@ class BackgroundAgentRunner:
         )
         add_script_run_ctx(self._thread)
 
-    def run(self, initial_message: Content):
-        self._input_queue.put(initial_message)
+    @property
+    def error(self) -> Exception | None:
+        """The exception that ended the worker, e.g. a failed agent startup."""
+        return self._error
+
+    def run(self, initial_message: Content | None = None):
+        if initial_message is not None:
+            self._input_queue.put_nowait(initial_message)
+        self._task = self._loop.create_task(self._run_loop())
         self._thread.start()
 
     def _run(self):
-        asyncio.run(self._run_loop())
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # Keep the error for the UI; the thread has no one to raise it to.
+            logger.exception("Agent worker stopped with an error.")
+            self._error = e
+        finally:
+            try:
+                self._loop.run_until_complete(self._shutdown())
+            finally:
+                self._loop.close()
+
+    async def _shutdown(self):
+        # Mirror asyncio.run(): cancel leftover tasks (e.g. the MCP session
+        # task) so their cleanup runs, then release generators and executor.
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self._loop.shutdown_asyncgens()
+        await self._loop.shutdown_default_executor()
 
     async def _run_loop(self):
         self._agent = build_agent(is_agent_mode=True, api_key=self._api_key)
@@ -62,47 +111,71 @@ class BackgroundAgentRunner:
         self._run_config = RunConfig(
             streaming_mode=StreamingMode.SSE, max_llm_calls=100
         )
-        while not self._stop.is_set():
+        while True:
+            messages = [await self._input_queue.get()]
+            # Fold messages that piled up during the previous run into one turn.
+            while (
+                not self._input_queue.empty() and len(messages) < MAX_BATCHED_MESSAGES
+            ):
+                messages.append(self._input_queue.get_nowait())
+            message = merge_user_messages(messages)
+            self._current_run = asyncio.ensure_future(self._run_turn(message))
             try:
-                message = self._input_queue.get(timeout=1)
-                invocation_id = None
-                agen = self._runner.run_async(
-                    user_id=self._user_id,
-                    session_id=self._session.id,
-                    new_message=message,
-                    run_config=self._run_config,
-                )
-                self._interrupt.clear()
-                async for event in agen:
-                    # Append new message manualy
-                    if invocation_id is None:
-                        invocation_id = event.invocation_id
-                        self._event_history.append(
-                            Event(
-                                content=message,
-                                author="user",
-                                invocation_id=invocation_id,
-                            )
+                await self._current_run
+            except asyncio.CancelledError:
+                # Swallow an interrupted turn, but let stop() end the loop.
+                if asyncio.current_task().cancelling():
+                    raise
+            finally:
+                self._current_run = None
+
+    async def _run_turn(self, message: Content):
+        invocation_id = None
+        agen = self._runner.run_async(
+            user_id=self._user_id,
+            session_id=self._session.id,
+            new_message=message,
+            run_config=self._run_config,
+        )
+        try:
+            async for event in agen:
+                # Append new message manualy
+                if invocation_id is None:
+                    invocation_id = event.invocation_id
+                    self._event_history.append(
+                        Event(
+                            content=message,
+                            author="user",
+                            invocation_id=invocation_id,
                         )
-                    self._event_history.append(event)
-                    if self._stop.is_set():
-                        break
-                    if self._interrupt.is_set():
-                        self._interrupt.clear()
-                        break
-                self._input_queue.task_done()
-            except Empty:
-                continue
+                    )
+                self._event_history.append(event)
+        finally:
+            if invocation_id is None:
+                # Interrupted before the first event; still show the message.
+                self._event_history.append(Event(content=message, author="user"))
+            await agen.aclose()
 
     def add_message(self, message: Content):
-        self._input_queue.put(message)
-        self._interrupt.set()
+        # Cancel the run that is live now, so a run blocked on the model or a
+        # tool stops right away and the run started for this message is safe.
+        current_run = self._current_run
+        if current_run is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(current_run.cancel)
+        self._post(message)
 
     def get_event_history(self) -> list[Event]:
         return list[Event](self._event_history)
 
     def stop(self):
-        self._stop.set()
+        # Cancel rather than flag, so a run blocked on the model or a tool
+        # is aborted right away instead of at its next event.
+        if self._task is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._task.cancel)
+
+    def _post(self, message: Content):
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._input_queue.put_nowait, message)
 
 
 def create_conversation_session(initial_prompt: str) -> dict[any]:
@@ -118,87 +191,104 @@ def create_conversation_session(initial_prompt: str) -> dict[any]:
     return session
 
 
+_DETAILS_TEMPLATE = (
+    "\n\n<details>\n<summary>{summary}</summary>\n\n"
+    "```{lang}\n{body}\n```\n\n</details>\n\n"
+)
+
+
+def format_tool_call(function_call) -> str:
+    tool_name = function_call.name
+    if tool_name == "exit_loop":
+        return "\n\n Task completed.\n"
+    if tool_name == "ask":
+        return "\n\n Ask user\n\n"
+    tool_args = json.dumps(function_call.args, indent=2, ensure_ascii=False)
+    return _DETAILS_TEMPLATE.format(
+        summary=f"Tool Call: {tool_name}", lang="json", body=tool_args
+    )
+
+
+def format_tool_response(function_response) -> str:
+    tool_name = function_response.name
+    raw_response = function_response.response
+    try:
+        # Try to serialize the response to a pretty JSON string.
+        tool_response = json.dumps(raw_response, indent=2, ensure_ascii=False)
+        lang = "json"
+    except TypeError:
+        tool_response, lang = _format_unserializable_response(raw_response)
+    return _DETAILS_TEMPLATE.format(
+        summary=f"Tool Response: {tool_name}", lang=lang, body=tool_response
+    )
+
+
+def _format_unserializable_response(raw_response) -> tuple[str, str]:
+    # If serialization fails, check for a nested CallToolResult.
+    if isinstance(raw_response, dict) and "result" in raw_response:
+        result_obj = raw_response["result"]
+        # Check if it looks like a CallToolResult with nested JSON.
+        if (
+            hasattr(result_obj, "content")
+            and result_obj.content
+            and hasattr(result_obj.content[0], "text")
+        ):
+            try:
+                # Extract and format the nested JSON string.
+                parsed_text = json.loads(result_obj.content[0].text)
+                return json.dumps(parsed_text, indent=2, ensure_ascii=False), "json"
+            except (json.JSONDecodeError, IndexError):
+                pass  # Not a valid JSON string, proceed to str() fallback
+    # The ultimate fallback: convert the object to a plain string.
+    return str(raw_response), ""
+
+
 def process_event(event: Event) -> tuple[str | None, str | None, str | None]:
     author = event.author
-    if event.content is None:
+    if event.content is None or not event.content.parts:
         return author, None, None
 
     # Skip final response since it overlaps with the previous event
     if author != "user" and event.is_final_response():
         return author, None, None
 
-    response_markdown = ""
-    thoughts_markdown = ""
+    response_parts: list[str] = []
+    thought_parts: list[str] = []
 
-    parts = event.content.parts or []
-    for part in parts:
+    for part in event.content.parts:
         if part.thought:
-            thoughts_markdown += part.text
+            thought_parts.append(part.text)
         elif part.function_call:
-            tool_name = part.function_call.name
-            if tool_name == "exit_loop":
-                response_markdown += "\n\n Task completed.\n"
-            elif tool_name == "ask":
-                response_markdown += "\n\n Ask user\n\n"
-            else:
-                tool_args = json.dumps(
-                    part.function_call.args, indent=2, ensure_ascii=False
-                )
-                response_markdown += (
-                    f"\n\n<details>\n<summary>Tool Call: {tool_name}</summary>\n\n"
-                    f"```json\n{tool_args}\n```\n\n</details>\n\n"
-                )
+            response_parts.append(format_tool_call(part.function_call))
         elif part.function_response:
-            tool_name = part.function_response.name
-            try:
-                # Try to serialize the response to a pretty JSON string.
-                tool_response = json.dumps(
-                    part.function_response.response, indent=2, ensure_ascii=False
-                )
-                lang = "json"
-            except TypeError:
-                # If serialization fails, check for a nested CallToolResult.
-                raw_response = part.function_response.response
-                extracted_json = None
-                if isinstance(raw_response, dict) and "result" in raw_response:
-                    result_obj = raw_response["result"]
-                    # Check if it looks like a CallToolResult with nested JSON.
-                    if (
-                        hasattr(result_obj, "content")
-                        and result_obj.content
-                        and hasattr(result_obj.content[0], "text")
-                    ):
-                        try:
-                            # Extract and format the nested JSON string.
-                            parsed_text = json.loads(result_obj.content[0].text)
-                            extracted_json = json.dumps(
-                                parsed_text, indent=2, ensure_ascii=False
-                            )
-                        except (json.JSONDecodeError, IndexError):
-                            pass  # Not a valid JSON string, proceed to str() fallback
-                if extracted_json:
-                    tool_response = extracted_json
-                    lang = "json"
-                else:
-                    # The ultimate fallback: convert the object to a plain string.
-                    tool_response = str(raw_response)
-                    lang = ""
-            response_markdown += (
-                f"\n\n<details>\n<summary>Tool Response: {tool_name}</summary>\n\n"
-                f"```{lang}\n{tool_response}\n```\n\n</details>\n\n"
-            )
+            response_parts.append(format_tool_response(part.function_response))
         elif part.text:
-            response_markdown += part.text
+            response_parts.append(part.text)
 
+    response_markdown = "".join(response_parts)
+    thoughts_markdown = "".join(thought_parts)
     return author, response_markdown or None, thoughts_markdown or None
 
 
-def group_events(events: list[Event]) -> list[tuple[str, str, str, bool]]:
-    grouped = []
-    current_author = None
-    current_response = ""
-    current_thoughts = ""
-    is_thinking = False
+def group_events(
+    events: list[Event],
+    grouped: list[tuple[str, str, str, bool]] | None = None,
+) -> list[tuple[str, str, str, bool]]:
+    """Groups consecutive events by author.
+
+    When grouped is the result for earlier events, only the new events are
+    processed and the last group is extended in place of a full regroup.
+    """
+    grouped = list(grouped or [])
+    response_parts: list[str] = []
+    thought_parts: list[str] = []
+    if grouped:
+        current_author, current_response, current_thoughts, is_thinking = grouped.pop()
+        response_parts.append(current_response)
+        thought_parts.append(current_thoughts)
+    else:
+        current_author = None
+        is_thinking = False
 
     for event in events:
         author, response, thoughts = process_event(event)
@@ -210,26 +300,52 @@ def group_events(events: list[Event]) -> list[tuple[str, str, str, bool]]:
 
         if author != current_author:
             grouped.append(
-                (current_author, current_response, current_thoughts, is_thinking)
+                (
+                    current_author,
+                    "".join(response_parts),
+                    "".join(thought_parts),
+                    is_thinking,
+                )
             )
             current_author = author
-            current_response = ""
-            current_thoughts = ""
+            response_parts = []
+            thought_parts = []
 
         if response:
-            current_response += response
+            response_parts.append(response)
             is_thinking = False
         if thoughts:
-            current_thoughts += thoughts + "\n\n"
+            thought_parts.append(thoughts)
+            thought_parts.append("\n\n")
             is_thinking = True
 
     if current_author is not None:
         grouped.append(
-            (current_author, current_response, current_thoughts, is_thinking)
+            (
+                current_author,
+                "".join(response_parts),
+                "".join(thought_parts),
+                is_thinking,
+            )
         )
     return grouped
 
 
+def get_grouped_events(
+    conversation_session: dict,
+) -> list[tuple[str, str, str, bool]]:
+    """Groups the worker's events, processing only those added since last time."""
+    events = conversation_session["worker"].get_event_history()
+    count, grouped = conversation_session.get("grouped_events", (0, []))
+    if count > len(events):
+        # The history was replaced; start over.
+        count, grouped = 0, []
+    if count != len(events):
+        grouped = group_events(events[count:], grouped)
+        conversation_session["grouped_events"] = (len(events), grouped)
+    return grouped
+
+
 def init():
     if "user_id" not in st.session_state:
         st.session_state.user_id = str(uuid.uuid4())
@@ -292,28 +408,37 @@ def main():
                 "Query", value=st.session_state.initial_prompt, height=240
             )
             if st.form_submit_button("Submit") and prompt:
-                # create conversation_session
-                st.session_state.conversation_session = create_conversation_session(
-                    prompt
-                )
-                st.rerun()
+                if not st.session_state.api_key:
+                    # Without a key the worker's agent cannot be built.
+                    st.error("Set a Gemini API key in the sidebar first.")
+                else:
+                    # create conversation_session
+                    st.session_state.conversation_session = create_conversation_session(
+                        prompt
+                    )
+                    st.rerun()
     else:
         conversation_session = st.session_state.conversation_session
 
+        error = conversation_session["worker"].error
+        if error is not None:
+            st.error(f"The agent stopped with an error: {error}")
+
         user_input = st.chat_input("Input your request")
         if user_input:
             conversation_session["worker"].add_message(
                 Content(role="user", parts=[Part(text=user_input)])
             )
 
-        for author, response, thoughts, is_thinking in group_events(
-            conversation_session["worker"].get_event_history()
+        for author, response, thoughts, is_thinking in get_grouped_events(
+            conversation_session
         ):
             with st.chat_message(name=author, avatar=AVATARS.get(author)):
                 if thoughts and not is_thinking:
                     with st.expander("Thoughts", expanded=False):
                         st.markdown(thoughts, unsafe_allow_html=True)
-                st.markdown(response, unsafe_allow_html=True)
+                if response:
+                    st.markdown(response, unsafe_allow_html=True)
                 if is_thinking:
                     matches = re.findall(r"(\*\*.*?\*\*)", thoughts, flags=re.DOTALL)
                     thought_title = matches[-1] if matches else "Thinking..."
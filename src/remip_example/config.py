@@ -4,6 +4,7 @@
 APP_NAME = "remip"
 AVATARS = {"remip_agent": "🦸", "mentor_agent": "🧚", "user": "👤"}
 NORMAL_MAX_CALLS = 100
+MAX_BATCHED_MESSAGES = 8
 
 EXAMPLES_DIR = "examples"
 
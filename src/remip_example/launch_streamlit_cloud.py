@@ -3,20 +3,35 @@ import os
 import streamlit as st
 
 from remip_example import app
-from remip_example.utils import ensure_node, start_remip, start_remip_mcp
+from remip_example.utils import (
+    NODE_VERSION,
+    ensure_node,
+    node_major_version,
+    start_remip,
+    start_remip_mcp,
+)
 
 
 if __name__ == "__main__":
-    NODE_BIN_DIR = ensure_node()
-    if str(NODE_BIN_DIR) not in os.environ["PATH"]:
-        os.environ["PATH"] = os.pathsep.join(
-            (str(NODE_BIN_DIR), os.environ.get("PATH", ""))
-        )
+    # Only provision a private Node.js when the host lacks npx or its node is
+    # older than the pinned release that remip-mcp is run with.
+    system_node = node_major_version()
+    if system_node is None or system_node < int(NODE_VERSION.split(".", 1)[0]):
+        NODE_BIN_DIR = ensure_node()
+        if str(NODE_BIN_DIR) not in os.environ["PATH"]:
+            os.environ["PATH"] = os.pathsep.join(
+                (str(NODE_BIN_DIR), os.environ.get("PATH", ""))
+            )
 
     # Hack to avoid error
     if "__streamlit_community_cloud_initialized__" not in st.session_state:
-        start_remip()
-        start_remip_mcp()
+        try:
+            start_remip()
+            start_remip_mcp()
+        except RuntimeError as e:
+            # e.g. npx or uvx missing; show it rather than a dead agent later.
+            st.error(str(e))
+            st.stop()
         st.session_state.__streamlit_community_cloud_initialized__ = True
         st.rerun()
 
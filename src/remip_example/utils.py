@@ -1,122 +1,236 @@
 """Utility functions for the remip-sample application."""
 
 import atexit
+import errno
+import functools
+import hashlib
+import http.client
+import logging
 import os
 import pathlib
+import selectors
+import shutil
 import signal
 import socket
 import subprocess
 import tarfile
+import tempfile
+import threading
 import time
 import urllib.request
+import zlib
 
-import streamlit as st
 from google.adk.tools.mcp_tool.mcp_session_manager import StreamableHTTPConnectionParams
 from google.adk.tools.mcp_tool.mcp_toolset import McpToolset
 
 from remip_example.config import MCP_PORT, EXAMPLES_DIR
 
+logger = logging.getLogger(__name__)
+
+# The Node.js release provisioned when the host has no recent enough node.
+NODE_VERSION = "24.8.0"
+
+
+# Parsed examples per language, stored with the (name, mtime) of their files.
+_examples_cache: dict[str, tuple[tuple[tuple[str, float], ...], dict[str, str]]] = {}
+
 
 def load_examples(language: str = "ja"):
-    """Loads example prompts from the specified language directory."""
+    """Loads example prompts from the specified language directory.
+
+    Results are reused until a file in the directory is added, removed or modified.
+    """
     module_dir = pathlib.Path(__file__).parent
     examples_base_dir = module_dir / EXAMPLES_DIR
     examples_dir: pathlib.Path = examples_base_dir / language
 
-    examples = {}
     if not examples_dir.exists():
-        print(f"Warning: Examples directory not found at {examples_dir}")
+        logger.warning("Examples directory not found at %s", examples_dir)
         return {}  # Return empty if not found
 
-    for path in examples_dir.glob("*.md"):
-        with open(path, "r", encoding="utf-8") as f:
-            contents = f.readlines()
+    paths = sorted(examples_dir.glob("*.md"))
+    signature = tuple((path.name, path.stat().st_mtime) for path in paths)
+    cached = _examples_cache.get(language)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    examples = {}
+    for path in paths:
+        contents = path.read_text(encoding="utf-8")
         if contents:
             # Use the first line (title) as the key
-            examples[contents[0][2:].strip()] = "".join(contents)
+            title = contents.split("\n", 1)[0]
+            examples[title[2:].strip()] = contents
+    _examples_cache[language] = (signature, examples)
     return examples
 
 
+def _probe_port(host: str, port: int, timeout: float) -> bool:
+    """Returns whether host:port accepts a connection, trying exactly once."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.setblocking(False)
+        err = sock.connect_ex((host, port))
+        if err in (errno.EINPROGRESS, errno.EAGAIN, errno.EWOULDBLOCK):
+            # Wake up as soon as the handshake completes instead of sleeping.
+            with selectors.DefaultSelector() as sel:
+                sel.register(sock, selectors.EVENT_WRITE)
+                if not sel.select(timeout):
+                    return False
+            err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        return err in (0, errno.EISCONN)
+
+
 def wait_for_port(
-    host: str, port: int, timeout: float = 10.0, interval: float = 0.1
+    host: str, port: int, timeout: float = 10.0, max_interval: float = 0.2
 ) -> bool:
-    """Waits for the specified host:port to start listening."""
-    deadline = time.time() + timeout
-    while time.time() < deadline:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.settimeout(interval)
-            result = sock.connect_ex((host, port))
-            if result == 0:
-                return True
-        time.sleep(interval)
+    """Waits for the specified host:port to start listening.
+
+    Retries with exponential backoff, starting at 5ms and capped at max_interval.
+    """
+    deadline = time.monotonic() + timeout
+    delay = 0.005
+    while time.monotonic() < deadline:
+        if _probe_port(host, port, max_interval):
+            return True
+        time.sleep(delay)
+        delay = min(delay * 2, max_interval)
     return False
 
 
-# Global variable to hold the server process so we can terminate it on exit.
-_mcp_server_process: subprocess.Popen | None = None
+def _once_per_process(func):
+    """Caches func's result per arguments for the life of the process.
+
+    Concurrent first calls are serialized, so the work runs exactly once.
+    Failures are not cached.
+    """
+    lock = threading.Lock()
+    results = {}
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        with lock:
+            if key not in results:
+                results[key] = func(*args, **kwargs)
+            return results[key]
+
+    return wrapper
+
+
+# Server processes started by this module, terminated together on exit.
+_server_processes: list[subprocess.Popen] = []
+
+
+def _track_server_process(proc: subprocess.Popen) -> None:
+    if not _server_processes:
+        atexit.register(_cleanup_mcp_server_group)
+    _server_processes.append(proc)
+
+
+def _process_group_alive(pgid: int) -> bool:
+    """Returns whether any process is still in the group pgid."""
+    try:
+        os.killpg(pgid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _terminate_process_group(proc: subprocess.Popen, grace_period: float = 5.0) -> None:
+    """Sends SIGTERM to the process group of proc, escalating to SIGKILL."""
+    # Servers start with start_new_session=True, so the group id is the
+    # leader's pid and stays valid for its children after the leader exits.
+    pgid = proc.pid
+    try:
+        os.killpg(pgid, signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        proc.poll()
+        return
+
+    logger.info("Terminating ReMIP server process group (PGID: %s)...", pgid)
+    deadline = time.monotonic() + grace_period
+    # Reap the leader each round so it does not count as a live member.
+    while proc.poll() is None or _process_group_alive(pgid):
+        if time.monotonic() >= deadline:
+            break
+        time.sleep(0.05)
+    else:
+        logger.info("ReMIP server process group terminated.")
+        return
+
+    logger.warning("Process group did not terminate gracefully. Forcing kill.")
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    proc.wait()
 
 
 def _cleanup_mcp_server_group():
-    """Cleanup function to terminate the entire MCP server process group."""
-    global _mcp_server_process
-    if _mcp_server_process and _mcp_server_process.poll() is None:
-        print(
-            "Terminating ReMIP server process group (PGID:"
-            f" {os.getpgid(_mcp_server_process.pid)})..."
+    """Cleanup function to terminate every server process group we started."""
+    for proc in _server_processes:
+        _terminate_process_group(proc)
+
+
+def _require_executable(name: str) -> str:
+    """Resolves name on the current PATH, failing with an actionable message."""
+    path = shutil.which(name)
+    if path is None:
+        raise RuntimeError(
+            f"{name} was not found on PATH. Install it or add its directory to PATH."
         )
-        try:
-            # Send SIGTERM to the entire process group.
-            os.killpg(os.getpgid(_mcp_server_process.pid), signal.SIGTERM)
-            _mcp_server_process.wait(timeout=5)
-            print("ReMIP server process group terminated.")
-        except (ProcessLookupError, PermissionError):
-            pass
-        except subprocess.TimeoutExpired:
-            print("Process group did not terminate gracefully. Forcing kill.")
-            os.killpg(os.getpgid(_mcp_server_process.pid), signal.SIGKILL)
-            _mcp_server_process.wait()
-
-
-@st.cache_resource
+    return path
+
+
+@_once_per_process
 def start_remip_mcp() -> int:
     """
     Starts the remip-mcp server in a new process group and returns the port.
     This ensures the server and any of its children can be terminated together.
     """
     port = MCP_PORT
+    if _probe_port("localhost", port, timeout=0.2):
+        # Already served, e.g. by an earlier process or a cleared cache.
+        return port
     proc = subprocess.Popen(
-        f"npx -y github:ohtaman/remip-mcp --http --start-remip-server --port {port}",
-        shell=True,
+        [
+            _require_executable("npx"),
+            "-y",
+            "github:ohtaman/remip-mcp",
+            "--http",
+            "--start-remip-server",
+            "--port",
+            str(port),
+        ],
         start_new_session=True,
     )
 
-    global _mcp_server_process
-    _mcp_server_process = proc
-    atexit.register(_cleanup_mcp_server_group)
+    _track_server_process(proc)
 
     wait_for_port("localhost", port)
     return port
 
 
-@st.cache_resource
+@_once_per_process
 def start_remip() -> int:
     port = 9999
+    if _probe_port("localhost", port, timeout=0.2):
+        return port
     proc = subprocess.Popen(
-        f"uvx remip --port {port}",
-        shell=True,
+        [_require_executable("uvx"), "remip", "--port", str(port)],
         start_new_session=True,
     )
 
-    global _mcp_server_process
-    _mcp_server_process = proc
-    atexit.register(_cleanup_mcp_server_group)
+    _track_server_process(proc)
 
     wait_for_port("localhost", port)
     return port
 
 
 def get_mcp_toolset() -> McpToolset:
-    """Starts the MCP server and returns a cached toolset instance."""
+    """Starts the MCP server once and returns a new toolset connected to it."""
     port = start_remip_mcp()
     toolset = McpToolset(
         connection_params=StreamableHTTPConnectionParams(
@@ -128,58 +242,104 @@ def get_mcp_toolset() -> McpToolset:
     return toolset
 
 
-@st.cache_resource
-def ensure_node(version: str = "24.8.0", install_dir: str = ".node") -> str:
+@_once_per_process
+def node_major_version() -> int | None:
+    """Returns the major version of the node on PATH, or None without node or npx."""
+    node = shutil.which("node")
+    if node is None or shutil.which("npx") is None:
+        return None
+    result = subprocess.run([node, "--version"], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    # node prints e.g. "v24.8.0".
+    major = result.stdout.strip().lstrip("v").split(".", 1)[0]
+    return int(major) if major.isdigit() else None
+
+
+@_once_per_process
+def _node_tarball_sha256(version: str, filename: str) -> str:
+    """Returns the published SHA-256 of a Node.js release file."""
+    url = f"https://nodejs.org/dist/v{version}/SHASUMS256.txt"
+    with urllib.request.urlopen(url) as r:
+        for line in r.read().decode("utf-8").splitlines():
+            digest, _, name = line.partition("  ")
+            if name == filename:
+                return digest
+    raise RuntimeError(f"No checksum published for {filename} in {url}")
+
+
+class _HashingReader:
+    """Wraps a binary stream and hashes everything read through it."""
+
+    def __init__(self, raw, digest):
+        self._raw = raw
+        self.digest = digest
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._raw.read(size)
+        self.digest.update(data)
+        return data
+
+
+def _download_node(url: str, dest: pathlib.Path, expected_sha256: str) -> None:
+    """Downloads the tarball at url and, once its checksum matches, extracts it."""
+    tarball = dest / "node.tar.gz"
+    with urllib.request.urlopen(url) as r, open(tarball, "wb") as f:
+        reader = _HashingReader(r, hashlib.sha256())
+        shutil.copyfileobj(reader, f, 1 << 20)
+    digest = reader.digest.hexdigest()
+    if digest != expected_sha256:
+        raise RuntimeError(
+            f"Checksum mismatch: expected {expected_sha256}, got {digest}"
+        )
+    with tarfile.open(tarball, mode="r:gz") as f:
+        if hasattr(tarfile, "data_filter"):
+            # Rejects absolute paths and links escaping dest.
+            f.extractall(dest, filter="data")
+        else:
+            # Only reached with a tarball whose published checksum matched.
+            f.extractall(dest)
+
+
+# Errors of a broken download: truncated streams fail in the HTTP client, in
+# gzip or in tarfile before any checksum can be compared.
+_DOWNLOAD_ERRORS = (
+    RuntimeError,
+    OSError,
+    EOFError,
+    zlib.error,
+    tarfile.TarError,
+    http.client.HTTPException,
+)
+
+
+@_once_per_process
+def ensure_node(version: str = NODE_VERSION, install_dir: str = ".node") -> str:
     base_path = pathlib.Path.cwd() / install_dir
-    node_path = base_path / f"node-v{version}-linux-x64"
-    bin_path = node_path / "bin"
-    node_path = bin_path / "node"
+    dist_name = f"node-v{version}-linux-x64"
+    bin_path = base_path / dist_name / "bin"
+    node_executable = bin_path / "node"
 
-    if not node_path.exists():
+    if not node_executable.exists():
         base_path.mkdir(parents=True, exist_ok=True)
-        url = f"https://nodejs.org/dist/v{version}/node-v{version}-linux-x64.tar.gz"
-        tarball_path = base_path / f"node-v{version}-linux-x64.tar.gz"
-        with urllib.request.urlopen(url) as r:
-            with open(tarball_path, "wb") as f:
-                f.write(r.read())
-        with tarfile.open(tarball_path, "r:gz") as f:
-            f.extractall(base_path)
-
-    return bin_path.absolute()
-
-
-@st.cache_resource
-def ensure_http_server(port: int = 3333) -> int:
-    """
-    Start the MCP server (HTTP mode) once per Streamlit session, and keep it alive
-    across reruns. It will be terminated by the atexit handler when the process exits.
-    """
-    proc = subprocess.Popen(
-        [
-            "npx",
-            "-y",
-            "github:ohtaman/remip-mcp",
-            "--http",
-            "--start-remip-server",
-            "--port",
-            str(port),
-        ],
-        start_new_session=True,
-    )
-
-    def _cleanup():
-        try:
-            os.killpg(os.getpgid(proc.pid), signal.SIGTERM)
-            proc.wait(timeout=5)
-        except Exception:
-            try:
-                os.killpg(os.getpgid(proc.pid), signal.SIGKILL)
-                proc.wait()
-            except Exception:
-                pass
-
-    atexit.register(_cleanup)
-
-    if not wait_for_port("127.0.0.1", port, timeout=10.0):
-        raise RuntimeError(f"MCP HTTP server failed to start on port {port}")
-    return port
+        url = f"https://nodejs.org/dist/v{version}/{dist_name}.tar.gz"
+        expected_sha256 = _node_tarball_sha256(version, f"{dist_name}.tar.gz")
+        attempts = 2
+        for attempt in range(1, attempts + 1):
+            # Extract aside and move into place only once extraction succeeds,
+            # so a broken download never leaves a half-populated install.
+            with tempfile.TemporaryDirectory(dir=base_path) as tmp:
+                try:
+                    _download_node(url, pathlib.Path(tmp), expected_sha256)
+                except _DOWNLOAD_ERRORS as e:
+                    error = e
+                else:
+                    shutil.rmtree(base_path / dist_name, ignore_errors=True)
+                    os.replace(pathlib.Path(tmp) / dist_name, base_path / dist_name)
+                    break
+            if attempt < attempts:
+                logger.warning("Downloading %s failed (%s), trying again.", url, error)
+        else:
+            raise RuntimeError(f"Could not download {url}: {error}") from error
+
+    return str(bin_path.absolute())
@@ -1,4 +1,7 @@
-from unittest.mock import patch, MagicMock
+import tracemalloc
+from types import SimpleNamespace
+from unittest.mock import patch
+
 from google.adk.agents import LlmAgent, LoopAgent
 from remip_example.agent import (
     build_agent,
@@ -52,22 +55,17 @@ def test_build_agent_with_api_key(mock_gen_model):
 
 def test_clear_tool_calling_track():
     """Test that clear_tool_calling_track resets the 'tools_used' state."""
-    callback_context = MagicMock()
-    callback_context.state = {"tools_used": ["some_tool"]}
+    callback_context = SimpleNamespace(state={"tools_used": ["some_tool"]})
     clear_tool_calling_track(callback_context)
     assert callback_context.state["tools_used"] == []
 
 
 def test_track_tool_calling_appends_record():
     """Test that track_tool_calling adds a new tool usage record to the state."""
-    tool = MagicMock()
-    tool.name = "test_tool"
+    tool = SimpleNamespace(name="test_tool")
     args = {"arg1": "value1"}
-    tool_context = MagicMock()
-    tool_context.state = {"tools_used": []}
-    tool_context.agent_name = "test_agent"
-    tool_response = MagicMock()
-    tool_response.isError = False
+    tool_context = SimpleNamespace(state={"tools_used": []}, agent_name="test_agent")
+    tool_response = SimpleNamespace(isError=False)
 
     track_tool_calling(tool, args, tool_context, tool_response)
 
@@ -80,14 +78,10 @@ def test_track_tool_calling_appends_record():
 
 def test_track_tool_calling_creates_list():
     """Test that track_tool_calling creates the 'tools_used' list if it doesn't exist."""
-    tool = MagicMock()
-    tool.name = "test_tool"
+    tool = SimpleNamespace(name="test_tool")
     args = {}
-    tool_context = MagicMock()
-    tool_context.state = {}
-    tool_context.agent_name = "test_agent"
-    tool_response = MagicMock()
-    tool_response.isError = False
+    tool_context = SimpleNamespace(state={}, agent_name="test_agent")
+    tool_response = SimpleNamespace(isError=False)
 
     track_tool_calling(tool, args, tool_context, tool_response)
     assert "tools_used" in tool_context.state
@@ -96,15 +90,11 @@ def test_track_tool_calling_creates_list():
 
 def test_track_tool_calling_truncates_long_args():
     """Test that track_tool_calling truncates long argument values."""
-    tool = MagicMock()
-    tool.name = "test_tool"
+    tool = SimpleNamespace(name="test_tool")
     long_value = "a" * 200
     args = {"long_arg": long_value}
-    tool_context = MagicMock()
-    tool_context.state = {"tools_used": []}
-    tool_context.agent_name = "test_agent"
-    tool_response = MagicMock()
-    tool_response.isError = False
+    tool_context = SimpleNamespace(state={"tools_used": []}, agent_name="test_agent")
+    tool_response = SimpleNamespace(isError=False)
 
     track_tool_calling(tool, args, tool_context, tool_response)
 
@@ -114,14 +104,71 @@ def test_track_tool_calling_truncates_long_args():
     assert truncated_arg.endswith("...")
 
 
+def test_track_tool_calling_truncates_bytes_and_non_str_args():
+    """Test that bytes and non-string argument values are truncated too."""
+    tool = SimpleNamespace(name="test_tool")
+    args = {
+        "blob": b"b" * 10_000_000,
+        "multibyte": "あ".encode() * 100,
+        "numbers": list(range(100)),
+        "short": 1,
+    }
+    tool_context = SimpleNamespace(state={}, agent_name="test_agent")
+
+    track_tool_calling(tool, args, tool_context, None)
+
+    record_args = tool_context.state["tools_used"][0]["args"]
+    assert record_args["blob"] == "b" * 128 + "..."
+    assert record_args["multibyte"].endswith("...")
+    assert len(record_args["numbers"]) == 128 + 3
+    assert record_args["short"] == "1"
+
+
+def test_track_tool_calling_renders_short_nested_args_unchanged():
+    """Test that nested arguments within the limit are recorded like str()."""
+    tool = SimpleNamespace(name="test_tool")
+    args = {
+        "model": {"a": {"b": {"c": 1}}, "quotes": ["it's", 'say "hi"', ("x",)]},
+        "rows": [[["x"]]],
+        "long": {"k": "x" * 200},
+    }
+    tool_context = SimpleNamespace(state={}, agent_name="test_agent")
+
+    track_tool_calling(tool, args, tool_context, None)
+
+    record_args = tool_context.state["tools_used"][0]["args"]
+    assert record_args["model"] == str(args["model"])
+    assert record_args["rows"] == "[[['x']]]"
+    assert record_args["long"] == str(args["long"])[:128] + "..."
+
+
+def test_track_tool_calling_bounds_memory_for_large_args():
+    """Test that truncating a 10MB argument does not render it in full."""
+    tool = SimpleNamespace(name="test_tool")
+    args = {
+        "text": "a" * 10_000_000,
+        "rows": ["b" * 1000] * 10_000,
+        "model": {"constraints": ["c" * 1000] * 10_000},
+    }
+    tool_context = SimpleNamespace(state={}, agent_name="test_agent")
+
+    tracemalloc.start()
+    try:
+        track_tool_calling(tool, args, tool_context, None)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert peak < 1_000_000
+    record_args = tool_context.state["tools_used"][0]["args"]
+    assert all(len(value) == 128 + 3 for value in record_args.values())
+
+
 def test_track_tool_calling_accepts_dict_response():
     """track_tool_calling should tolerate dict-based tool responses."""
-    tool = MagicMock()
-    tool.name = "dict_tool"
+    tool = SimpleNamespace(name="dict_tool")
     args = {}
-    tool_context = MagicMock()
-    tool_context.state = {}
-    tool_context.agent_name = "dict_agent"
+    tool_context = SimpleNamespace(state={}, agent_name="dict_agent")
     tool_response = {"result": "ok", "isError": False}
 
     track_tool_calling(tool, args, tool_context, tool_response)
@@ -132,12 +179,9 @@ def test_track_tool_calling_accepts_dict_response():
 
 def test_track_tool_calling_marks_error_from_dict():
     """track_tool_calling should mark dict responses with error keys as failures."""
-    tool = MagicMock()
-    tool.name = "dict_tool"
+    tool = SimpleNamespace(name="dict_tool")
     args = {}
-    tool_context = MagicMock()
-    tool_context.state = {}
-    tool_context.agent_name = "dict_agent"
+    tool_context = SimpleNamespace(state={}, agent_name="dict_agent")
     tool_response = {"error": "Something failed"}
 
     track_tool_calling(tool, args, tool_context, tool_response)
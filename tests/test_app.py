@@ -1,5 +1,19 @@
+import asyncio
+import threading
 from types import SimpleNamespace
-from remip_example.app import AVATARS, process_event
+from google.genai.types import Content, Part
+
+from remip_example import app
+from remip_example.app import (
+    AVATARS,
+    BackgroundAgentRunner,
+    format_tool_call,
+    format_tool_response,
+    get_grouped_events,
+    group_events,
+    merge_user_messages,
+    process_event,
+)
 
 
 def create_mock_event(author: str, parts: list, is_final: bool = False):
@@ -103,3 +117,240 @@ def test_process_event_skips_final_response():
     assert author == "remip_agent"
     assert response_md is None
     assert thoughts_md is None
+
+
+def test_process_event_with_no_content():
+    """Test that events without content or parts render nothing."""
+    no_content = SimpleNamespace(
+        author="remip_agent", content=None, is_final_response=lambda: False
+    )
+    assert process_event(no_content) == ("remip_agent", None, None)
+    assert process_event(create_mock_event("remip_agent", [])) == (
+        "remip_agent",
+        None,
+        None,
+    )
+
+
+def test_merge_user_messages_single_message_is_unchanged():
+    """Test that a single queued message is passed through as-is."""
+    message = Content(role="user", parts=[Part(text="only")])
+    assert merge_user_messages([message]) is message
+
+
+def test_merge_user_messages_joins_texts_in_order():
+    """Test that queued messages are folded into one user turn."""
+    messages = [
+        Content(role="user", parts=[Part(text="first")]),
+        Content(role="user", parts=[Part(text="second"), Part(text="third")]),
+    ]
+    merged = merge_user_messages(messages)
+    assert merged.role == "user"
+    assert [part.text for part in merged.parts] == ["first\n\nsecond\n\nthird"]
+
+
+def test_get_grouped_events_reuses_result_until_events_change():
+    """Test that the transcript is regrouped only when new events arrive."""
+    part = SimpleNamespace(
+        text="Hello", thought=None, function_call=None, function_response=None
+    )
+    events = [create_mock_event(author="user", parts=[part])]
+    worker = SimpleNamespace(get_event_history=lambda: list(events))
+    conversation_session = {"worker": worker}
+
+    first = get_grouped_events(conversation_session)
+    assert first == [("user", "Hello", "", False)]
+    assert get_grouped_events(conversation_session) is first
+
+    events.append(create_mock_event(author="remip_agent", parts=[part]))
+    second = get_grouped_events(conversation_session)
+    assert second is not first
+    assert [group[0] for group in second] == ["user", "remip_agent"]
+
+
+def test_group_events_resumes_from_previous_result():
+    """Test that grouping new events onto a previous result matches a full pass."""
+
+    def text_event(author, text, thought=None):
+        part = SimpleNamespace(
+            text=text, thought=thought, function_call=None, function_response=None
+        )
+        return create_mock_event(author=author, parts=[part])
+
+    events = [
+        text_event("user", "Solve this"),
+        text_event("remip_agent", "Planning", thought=True),
+        text_event("remip_agent", "Part one. "),
+        text_event("remip_agent", "Part two."),
+        text_event("mentor_agent", "Looks good"),
+    ]
+
+    for split in range(len(events) + 1):
+        resumed = group_events(events[split:], group_events(events[:split]))
+        assert resumed == group_events(events)
+
+
+def test_format_tool_call_summarizes_loop_control_tools():
+    """Test that exit_loop and ask are rendered as short status lines."""
+    assert "Task completed." in format_tool_call(
+        SimpleNamespace(name="exit_loop", args={})
+    )
+    assert "Ask user" in format_tool_call(SimpleNamespace(name="ask", args={}))
+
+
+def test_format_tool_response_extracts_nested_call_tool_result():
+    """Test that JSON text nested in an unserializable result is pretty-printed."""
+    result = SimpleNamespace(content=[SimpleNamespace(text='{"status": "optimal"}')])
+    function_response = SimpleNamespace(name="solve", response={"result": result})
+
+    markdown = format_tool_response(function_response)
+    assert "Tool Response: solve" in markdown
+    assert '```json\n{\n  "status": "optimal"\n}\n```' in markdown
+
+
+def test_format_tool_response_falls_back_to_str():
+    """Test that unserializable, non-JSON results are rendered with str()."""
+    result = SimpleNamespace(content=[SimpleNamespace(text="not json")])
+    function_response = SimpleNamespace(name="solve", response={"result": result})
+
+    markdown = format_tool_response(function_response)
+    assert f"```\n{function_response.response}\n```" in markdown
+
+
+def test_add_message_cancels_the_live_run():
+    """Test that a new message cancels a run blocked between events."""
+    first_event = asyncio.Event()
+
+    async def run_async(**kwargs):
+        yield SimpleNamespace(invocation_id="inv-1", author="remip_agent")
+        first_event.set()
+        await asyncio.sleep(30)
+        yield SimpleNamespace(invocation_id="inv-1", author="remip_agent")
+
+    worker = BackgroundAgentRunner(user_id="user", api_key="dummy_api_key")
+    worker._runner = SimpleNamespace(run_async=run_async)
+    worker._session = SimpleNamespace(id="session")
+    worker._run_config = None
+    message = Content(role="user", parts=[Part(text="first")])
+
+    async def interrupt():
+        worker._current_run = asyncio.ensure_future(worker._run_turn(message))
+        await first_event.wait()
+        worker.add_message(Content(role="user", parts=[Part(text="second")]))
+        try:
+            await asyncio.wait_for(worker._current_run, timeout=1)
+        except asyncio.CancelledError:
+            pass
+
+    worker._loop.run_until_complete(interrupt())
+    worker._loop.close()
+
+    history = worker.get_event_history()
+    assert [event.author for event in history] == ["user", "remip_agent"]
+    assert history[0].content == message
+
+
+class FakeSessionService:
+    """Stand-in for InMemorySessionService."""
+
+    async def create_session(self, *, app_name, user_id):
+        return SimpleNamespace(id="session", events=[])
+
+
+def patch_worker_dependencies(monkeypatch, session_service, run_async=None):
+    """Replaces the agent, runner and session store used by the worker."""
+    monkeypatch.setattr(app, "build_agent", lambda **kwargs: None)
+    monkeypatch.setattr(app, "InMemorySessionService", lambda: session_service)
+    monkeypatch.setattr(
+        app, "Runner", lambda **kwargs: SimpleNamespace(run_async=run_async)
+    )
+
+
+def test_worker_stop_cancels_leftover_tasks(monkeypatch):
+    """Test that background tasks started on the worker loop are cleaned up."""
+    cleaned_up = threading.Event()
+
+    async def background():
+        try:
+            await asyncio.sleep(30)
+        finally:
+            cleaned_up.set()
+
+    class SpawningSessionService(FakeSessionService):
+        async def create_session(self, **kwargs):
+            self.background = asyncio.ensure_future(background())
+            return await super().create_session(**kwargs)
+
+    patch_worker_dependencies(monkeypatch, SpawningSessionService())
+
+    worker = BackgroundAgentRunner(user_id="user", api_key="dummy_api_key")
+    worker.run()
+    worker.stop()
+    worker._thread.join(timeout=5)
+
+    assert cleaned_up.is_set()
+    assert worker._loop.is_closed()
+
+
+def test_worker_loop_interrupts_live_turn_and_stops(monkeypatch):
+    """Test that add_message interrupts a turn and stop() ends a live one."""
+    started = {"first": threading.Event(), "third": threading.Event()}
+    second_done = threading.Event()
+
+    async def run_async(*, new_message, **kwargs):
+        text = new_message.parts[0].text
+        yield SimpleNamespace(invocation_id=text, author="remip_agent", text=text)
+        if text in started:
+            started[text].set()
+            await asyncio.sleep(30)
+        second_done.set()
+
+    session_service = FakeSessionService()
+    patch_worker_dependencies(monkeypatch, session_service, run_async)
+
+    worker = BackgroundAgentRunner(user_id="user", api_key="dummy_api_key")
+    worker.run(Content(role="user", parts=[Part(text="first")]))
+    assert started["first"].wait(timeout=5)
+    worker.add_message(Content(role="user", parts=[Part(text="second")]))
+    assert second_done.wait(timeout=5)
+
+    worker.add_message(Content(role="user", parts=[Part(text="third")]))
+    assert started["third"].wait(timeout=5)
+    worker.stop()
+    worker._thread.join(timeout=5)
+
+    assert not worker._thread.is_alive()
+    assert worker._loop.is_closed()
+    history = [
+        (
+            event.author,
+            event.content.parts[0].text if event.author == "user" else event.text,
+        )
+        for event in worker.get_event_history()
+    ]
+    assert history == [
+        ("user", "first"),
+        ("remip_agent", "first"),
+        ("user", "second"),
+        ("remip_agent", "second"),
+        ("user", "third"),
+        ("remip_agent", "third"),
+    ]
+
+
+def test_worker_keeps_startup_error(monkeypatch):
+    """Test that a failure while building the agent is kept for the UI."""
+    patch_worker_dependencies(monkeypatch, FakeSessionService())
+
+    def failing_build_agent(**kwargs):
+        raise RuntimeError("npx was not found on PATH.")
+
+    monkeypatch.setattr(app, "build_agent", failing_build_agent)
+
+    worker = BackgroundAgentRunner(user_id="user", api_key="dummy_api_key")
+    worker.run(Content(role="user", parts=[Part(text="first")]))
+    worker._thread.join(timeout=5)
+
+    assert not worker._thread.is_alive()
+    assert isinstance(worker.error, RuntimeError)
+    assert str(worker.error) == "npx was not found on PATH."
@@ -0,0 +1,300 @@
+import hashlib
+import http.client
+import io
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from remip_example import utils
+from remip_example.utils import (
+    _once_per_process,
+    _require_executable,
+    _terminate_process_group,
+    ensure_node,
+    load_examples,
+    node_major_version,
+    wait_for_port,
+)
+
+
+def test_wait_for_port_returns_true_when_listening():
+    """Test that wait_for_port succeeds once something listens on the port."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        port = server.getsockname()[1]
+        assert wait_for_port("127.0.0.1", port, timeout=1.0)
+
+
+def test_wait_for_port_times_out_when_nothing_listens():
+    """Test that wait_for_port gives up after the timeout."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    assert not wait_for_port("127.0.0.1", port, timeout=0.2)
+
+
+def test_load_examples_uses_first_line_as_title():
+    """Test that example titles come from the markdown heading."""
+    examples = load_examples("ja")
+    assert examples
+    for title, content in examples.items():
+        assert content.startswith(f"# {title}")
+
+
+def test_load_examples_reuses_result_when_files_unchanged():
+    """Test that unchanged example files are not parsed again."""
+    assert load_examples("ja") is load_examples("ja")
+
+
+def test_load_examples_missing_language_returns_empty():
+    """Test that an unknown language yields no examples."""
+    assert load_examples("xx") == {}
+
+
+def test_terminate_process_group_stops_process():
+    """Test that a well-behaved process group exits on SIGTERM."""
+    proc = subprocess.Popen(
+        [sys.executable, "-c", "import time; time.sleep(30)"],
+        start_new_session=True,
+    )
+    _terminate_process_group(proc, grace_period=5.0)
+    assert proc.poll() is not None
+
+
+def test_terminate_process_group_escalates_to_sigkill():
+    """Test that a process ignoring SIGTERM is killed after the grace period."""
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            (
+                "import signal, sys, time\n"
+                "signal.signal(signal.SIGTERM, signal.SIG_IGN)\n"
+                "print('ready', flush=True)\n"
+                "time.sleep(30)"
+            ),
+        ],
+        start_new_session=True,
+        stdout=subprocess.PIPE,
+    )
+    proc.stdout.readline()
+    _terminate_process_group(proc, grace_period=0.2)
+    assert proc.returncode == -signal.SIGKILL
+
+
+def test_terminate_process_group_signals_orphaned_children():
+    """Test that children are terminated even after the group leader exited."""
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            (
+                "import subprocess, sys\n"
+                "child = subprocess.Popen([sys.executable, '-c',"
+                " 'import time; time.sleep(30)'])\n"
+                "print(child.pid, flush=True)"
+            ),
+        ],
+        start_new_session=True,
+        stdout=subprocess.PIPE,
+    )
+    child_pid = int(proc.stdout.readline())
+    proc.wait()
+
+    _terminate_process_group(proc, grace_period=5.0)
+    with pytest.raises(ProcessLookupError):
+        os.killpg(proc.pid, 0)
+    with pytest.raises(ProcessLookupError):
+        os.kill(child_pid, 0)
+
+
+def _make_node_tarball(version: str) -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tf:
+        data = b"#!/bin/sh\n"
+        info = tarfile.TarInfo(f"node-v{version}-linux-x64/bin/node")
+        info.size = len(data)
+        info.mode = 0o755
+        tf.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def _fake_nodejs_dist(version: str, tarball: bytes, published: bytes):
+    filename = f"node-v{version}-linux-x64.tar.gz"
+    shasums = f"{hashlib.sha256(published).hexdigest()}  {filename}\n".encode()
+
+    def urlopen(url):
+        if url.endswith("SHASUMS256.txt"):
+            return io.BytesIO(shasums)
+        assert url.endswith(filename)
+        return io.BytesIO(tarball)
+
+    return urlopen
+
+
+def test_ensure_node_installs_verified_tarball(tmp_path, monkeypatch):
+    """Test that a tarball matching the published checksum is installed."""
+    monkeypatch.chdir(tmp_path)
+    tarball = _make_node_tarball("0.0.1")
+    with patch("urllib.request.urlopen", _fake_nodejs_dist("0.0.1", tarball, tarball)):
+        bin_dir = ensure_node(version="0.0.1")
+    assert (Path(bin_dir) / "node").exists()
+
+
+def test_ensure_node_rejects_checksum_mismatch(tmp_path, monkeypatch, caplog):
+    """Test that a corrupted tarball is retried, then rejected without a trace."""
+    monkeypatch.chdir(tmp_path)
+    caplog.set_level(logging.WARNING, logger="remip_example.utils")
+    tarball = _make_node_tarball("0.0.2")
+    with (
+        patch(
+            "urllib.request.urlopen",
+            _fake_nodejs_dist("0.0.2", tarball, b"something else"),
+        ),
+        pytest.raises(RuntimeError, match="Checksum mismatch"),
+    ):
+        ensure_node(version="0.0.2")
+    assert list((tmp_path / ".node").iterdir()) == []
+    # Only the first failure is followed by another download.
+    retries = [r for r in caplog.records if "trying again" in r.message]
+    assert len(retries) == 1
+    assert "Checksum mismatch" in retries[0].message
+
+
+class _TruncatedStream(io.BytesIO):
+    """A response body that fails like a connection dropped mid-transfer."""
+
+    def read(self, size=-1):
+        data = super().read(size)
+        if not data:
+            raise http.client.IncompleteRead(b"", 1)
+        return data
+
+
+def test_ensure_node_retries_truncated_download(tmp_path, monkeypatch):
+    """Test that a transfer failing before the checksum is retried."""
+    monkeypatch.chdir(tmp_path)
+    tarball = _make_node_tarball("0.0.3")
+    urlopen = _fake_nodejs_dist("0.0.3", tarball, tarball)
+    responses = [_TruncatedStream(tarball[:10])]
+
+    def flaky_urlopen(url):
+        if responses and not url.endswith("SHASUMS256.txt"):
+            return responses.pop()
+        return urlopen(url)
+
+    with patch("urllib.request.urlopen", flaky_urlopen):
+        bin_dir = ensure_node(version="0.0.3")
+    assert (Path(bin_dir) / "node").exists()
+
+
+def test_ensure_node_reports_the_last_download_error(tmp_path, monkeypatch):
+    """Test that the final error names why the download failed."""
+    monkeypatch.chdir(tmp_path)
+    tarball = _make_node_tarball("0.0.4")
+    urlopen = _fake_nodejs_dist("0.0.4", tarball, tarball)
+
+    def truncated_urlopen(url):
+        if url.endswith("SHASUMS256.txt"):
+            return urlopen(url)
+        return _TruncatedStream(tarball[:10])
+
+    with (
+        patch("urllib.request.urlopen", truncated_urlopen),
+        pytest.raises(RuntimeError, match="IncompleteRead") as excinfo,
+    ):
+        ensure_node(version="0.0.4")
+    assert isinstance(excinfo.value.__cause__, http.client.IncompleteRead)
+    assert list((tmp_path / ".node").iterdir()) == []
+
+
+def _fake_node_on_path(tmp_path, monkeypatch, version: str) -> None:
+    for name, output in (("node", version), ("npx", "")):
+        path = tmp_path / name
+        path.write_text(f"#!/bin/sh\necho {output}\n")
+        path.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tmp_path))
+
+
+@pytest.mark.parametrize(("version", "major"), [("v24.8.0", 24), ("v18.19.1", 18)])
+def test_node_major_version_reads_node_on_path(tmp_path, monkeypatch, version, major):
+    """Test that the major version of the node on PATH is reported."""
+    _fake_node_on_path(tmp_path, monkeypatch, version)
+    assert node_major_version.__wrapped__() == major
+
+
+def test_node_major_version_requires_npx(tmp_path, monkeypatch):
+    """Test that a node without npx is treated as missing."""
+    _fake_node_on_path(tmp_path, monkeypatch, "v24.8.0")
+    (tmp_path / "npx").unlink()
+    assert node_major_version.__wrapped__() is None
+
+
+def test_require_executable_fails_when_not_on_path(monkeypatch):
+    """Test that a missing executable raises an actionable RuntimeError."""
+    monkeypatch.setenv("PATH", "")
+    with pytest.raises(RuntimeError, match="npx was not found on PATH"):
+        _require_executable("npx")
+
+
+def test_start_remip_mcp_fails_without_npx(monkeypatch):
+    """Test that starting the MCP server without npx fails before spawning."""
+    monkeypatch.setattr(utils, "_probe_port", lambda *args, **kwargs: False)
+    monkeypatch.setattr(utils.shutil, "which", lambda name: None)
+    with (
+        patch("subprocess.Popen") as popen,
+        pytest.raises(RuntimeError, match="npx was not found on PATH"),
+    ):
+        # Bypass the per-process cache, which other tests may have filled.
+        utils.start_remip_mcp.__wrapped__()
+    popen.assert_not_called()
+
+
+def test_once_per_process_runs_once_under_concurrency():
+    """Test that concurrent first calls share a single execution."""
+    calls = []
+
+    @_once_per_process
+    def start(port):
+        calls.append(port)
+        time.sleep(0.05)
+        return port
+
+    threads = [threading.Thread(target=start, args=(1,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert start(1) == 1
+    assert start(2) == 2
+    assert calls == [1, 2]
+
+
+def test_once_per_process_does_not_cache_failures():
+    """Test that a failing call is retried on the next invocation."""
+    attempts = []
+
+    @_once_per_process
+    def flaky():
+        attempts.append(None)
+        if len(attempts) == 1:
+            raise RuntimeError("boom")
+        return "ok"
+
+    with pytest.raises(RuntimeError):
+        flaky()
+    assert flaky() == "ok"
+    assert flaky() == "ok"
+    assert len(attempts) == 2